@@ -27,7 +27,7 @@
 import re
 
 from mininet.log import info, error, debug
-from mininet.util import makeIntfPair
+from mininet.util import makeIntfPair, quietRun, moveIntf
 import mininet.node
 
 # Make pylint happy:
@@ -76,31 +76,49 @@ def ifconfig( self, *args ):
 
     def setIP( self, ipstr, prefixLen=None, overwrite=True ):
         """Set our IP address"""
+        return self.node.ipBatch( self.setIPCmds( ipstr, prefixLen,
+                                                  overwrite ) )
+
+    def setIPCmds( self, ipstr, prefixLen=None, overwrite=True ):
+        """Record our IP address and return the ip commands to set it
+           (see setIP())"""
         # This is a sign that we should perhaps rethink our prefix
         # mechanism and/or the way we specify IP addresses
 
+        cmds = []
         # remove all old adresses (to remove side effects)
         # this is needed after the swtich from "ifconfig" to "ip"
         if overwrite:
-            self.cmd("ip", "address", "flush", "dev", self.name)
+            cmds.append( 'address flush dev %s' % self.name )
         # add the new address
         if '/' in ipstr:
             self.ip, self.prefixLen = ipstr.split( '/' )
-            return self.cmd('ip', 'address', 'add', ipstr, 'dev', self.name)
         else:
             if prefixLen is None:
                 raise Exception( 'No prefix length set for IP address %s'
                                  % ( ipstr, ) )
             self.ip, self.prefixLen = ipstr, prefixLen
-            return self.cmd('ip', 'address', 'add', '%s/%s' % (ipstr, prefixLen), 'dev', self.name)
+            ipstr = '%s/%s' % ( ipstr, prefixLen )
+        cmds.append( 'address add %s dev %s' % ( ipstr, self.name ) )
+        return cmds
 
     def setMAC( self, macstr ):
         """Set the MAC address for an interface.
            macstr: MAC address as string"""
+        if not getattr( self.node, 'ipBatchMode', False ):
+            self.mac = macstr
+            return ( self.ifconfig( 'down' ) +
+                     self.ifconfig( 'hw', 'ether', macstr ) +
+                     self.ifconfig( 'up' ) )
+        return self.node.ipBatch( self.setMACCmds( macstr ) )
+
+    def setMACCmds( self, macstr ):
+        """Record our MAC address and return the ip commands to set it
+           macstr: MAC address as string"""
         self.mac = macstr
-        return ( self.ifconfig( 'down' ) +
-                 self.ifconfig( 'hw', 'ether', macstr ) +
-                 self.ifconfig( 'up' ) )
+        return [ 'link set dev %s down' % self.name,
+                 'link set dev %s address %s' % ( self.name, macstr ),
+                 'link set dev %s up' % self.name ]
 
     _ipMatchRegex = re.compile( r'\d+\.\d+\.\d+\.\d+' )
     _macMatchRegex = re.compile( r'..:..:..:..:..:..' )
@@ -148,7 +166,7 @@ def isUp( self, setUp=False ):
         if setUp:
             cmdOutput = self.ifconfig( 'up' )
             # no output / command output indicates success
-            if (len(cmdOutput) > 0
+            if (cmdOutput
                     and "ifconfig" not in cmdOutput):
                 error( "Error setting %s up: %s " % ( self.name, cmdOutput ) )
                 return False
@@ -572,6 +590,87 @@ def makeIntfPair( self, *args, **kwargs ):
             return Link.makeIntfPair( *args, **kwargs )
 
 
+class InternalPortIntf( Intf ):
+    """Switch side of an InternalPortLink: there is no separate
+       netdev, since the OVS internal port lives in the other node"""
+
+    def ifconfig( self, *args ):
+        "Nothing to configure on the switch side"
+        return ''
+
+    def portName( self ):
+        "Return the name of the internal port on the OVS bridge"
+        intf1, intf2 = self.link.intf1, self.link.intf2
+        return str( intf1 if intf1 is not self else intf2 )
+
+    def delete( self ):
+        "The port itself is removed by InternalPortLink.delete()"
+        self.node.delIntf( self )
+        self.link = None
+
+
+class InternalPortLink( Link ):
+    """Link that connects a node to an OVSSwitch using an OVS internal
+       port which is moved into the node's namespace. This saves the
+       extra veth hop for every packet. Links that do not have exactly
+       one OVSSwitch endpoint fall back to veth pairs.
+       Note that the internal port is created on the bridge when the
+       link is created, so the switch keeps its bridge when started."""
+
+    def __init__( self, node1, node2, **kwargs ):
+        "See Link.__init__() for options"
+        try:
+            OVSSwitch
+        except NameError:
+            # pylint: disable=import-outside-toplevel,cyclic-import
+            from mininet.node import OVSSwitch
+        self.switch = None
+        if ( isinstance( node2, OVSSwitch ) and
+             not isinstance( node1, OVSSwitch ) ):
+            self.switch = node2
+            kwargs.update( cls2=InternalPortIntf )
+        elif ( isinstance( node1, OVSSwitch ) and
+               not isinstance( node2, OVSSwitch ) ):
+            self.switch = node1
+            kwargs.update( cls1=InternalPortIntf )
+        if self.switch:
+            # We move the port ourselves, see makeIntfPair()
+            kwargs.update( fast=True )
+        Link.__init__( self, node1, node2, **kwargs )
+
+    # pylint: disable=arguments-differ, signature-differs
+    def makeIntfPair( self, intfname1, intfname2, addr1=None, addr2=None,
+                      node1=None, node2=None, deleteIntfs=True ):
+        "Create an internal port on the switch and move it to the node"
+        if not self.switch:
+            return Link.makeIntfPair( intfname1, intfname2, addr1, addr2,
+                                      node1, node2, deleteIntfs=deleteIntfs )
+        if self.switch is node2:
+            intfname, addr, node = intfname1, addr1, node1
+        else:
+            intfname, addr, node = intfname2, addr2, node2
+        bridge = self.switch.deployed_name
+        cmdOutput = quietRun( 'ovs-vsctl --may-exist add-br %s'
+                              ' -- --may-exist add-port %s %s'
+                              ' -- set Interface %s type=internal' %
+                              ( bridge, bridge, intfname, intfname ) )
+        if cmdOutput:
+            raise Exception( "Error creating internal port %s on %s: %s " %
+                             ( intfname, bridge, cmdOutput ) )
+        if addr is not None:
+            quietRun( 'ip link set dev %s address %s' % ( intfname, addr ) )
+        moveIntf( intfname, node )
+        return None, None
+
+    def delete( self ):
+        "Delete this link, removing the internal port from the switch"
+        if self.switch:
+            intf = self.intf2 if self.switch is self.intf1.node else self.intf1
+            self.switch.vsctl( '--if-exists del-port',
+                               self.switch.deployed_name, intf )
+        Link.delete( self )
+
+
 class TCLink( Link ):
     "Link with TC interfaces"
     def __init__( self, *args, **kwargs):
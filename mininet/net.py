@@ -90,14 +90,12 @@
 import re
 import select
 import signal
-import random
-import shlex
 import ipaddress
 
-from sys import exit  # pylint: disable=redefined-builtin
+from sys import exit, intern  # pylint: disable=redefined-builtin
 from time import sleep
 from itertools import chain, groupby
-from math import ceil
+from math import ceil, sqrt
 
 from mininet.cli import CLI
 from mininet.log import info, error, debug, output, warn
@@ -107,10 +105,10 @@
 from mininet.link import Link, Intf
 from mininet.util import ( quietRun, fixLimits, numCores, ensureRoot,
                            macColonHex, ipStr, ipParse, netParse, ipAdd,
-                           waitListening, BaseString )
+                           waitListening, runParallel )
 from mininet.term import cleanUpScreens, makeTerms
 
-from subprocess import Popen
+from subprocess import Popen, PIPE, DEVNULL, call
 
 # Mininet version: should be consistent with README and LICENSE
 VERSION = "2.3.1b1"
@@ -120,6 +118,25 @@
 # so it can be removed at a later time
 SAP_PREFIX = 'sap.'
 
+# Regular expressions for parsing ping output
+_PING_RE = re.compile( r'(\d+) packets transmitted, (\d+)( packets)? received' )
+_PING_UNREACH_RE = re.compile( r'[uU]nreachable' )
+_PING_RTT_RE = re.compile( r'rtt min/avg/max/mdev = '
+                           r'(\d+\.\d+)/(\d+\.\d+)/(\d+\.\d+)/(\d+\.\d+) ms' )
+# Per-reply RTT, used to skip the first (ARP resolving) echo
+_PING_REPLY_RE = re.compile( r'icmp_seq=(\d+) .*time=(\d+(?:\.\d+)?) ms' )
+# fping -q summary line, e.g.
+# 10.0.0.2 : xmt/rcv/%loss = 1/1/0%, min/avg/max = 0.05/0.05/0.05
+_FPING_RE = re.compile( r'xmt/rcv/%loss = (\d+)/(\d+)/\d+%' )
+
+# Input line iptables-restore failed on, see Containernet._updateSAPNAT
+# ('line 5 failed' or 'Error occurred at line: 5' for legacy,
+# 'line 5: ... failed' for nf_tables)
+_IPTABLES_RESTORE_ERR_RE = re.compile( r'\bline:? (\d+)' )
+
+# Regular expression for parsing iperf output
+_IPERF_RATE_RE = re.compile( r'([\d\.]+ \w+/sec)' )
+
 class Mininet( object ):
     "Network emulation with hosts spawned in network namespaces."
 
@@ -175,11 +192,16 @@ def __init__( self, topo=None, switch=OVSKernelSwitch, host=Host,
         self.switches = []
         self.controllers = []
         self.links = []
+        self._linkIndex = {}  # { frozenset( ( node1, node2 ) ): [ links ] }
 
         self.nameToNode = {}  # name to Node (Host/Switch) objects
+        self._nodes = None  # cached ( names, nodes ), see _nodeCache()
 
         self.terms = []  # list of spawned xterm processes
 
+        self._hasFping = {}  # node to fping availability, see _pingHosts()
+        self._iperfServers = set()  # nodes which may run a stale iperf
+
         Mininet.init()  # Initialize Mininet if necessary
 
         self.built = False
@@ -193,15 +215,16 @@ def waitConnected( self, timeout=None, delay=.5 ):
            returns: True if all switches are connected"""
         info( '*** Waiting for switches to connect\n' )
         time = 0.0
-        remaining = list( self.switches )
+        remaining = set( self.switches )
         # False: 0s timeout; None: wait forever (preserve 2.2 behavior)
         if isinstance( timeout, bool ):
             timeout = None if timeout else 0
         while True:
-            for switch in tuple( remaining ):
-                if switch.connected():
-                    info( '%s ' % switch )
-                    remaining.remove( switch )
+            connected = [ switch for switch in self.switches
+                          if switch in remaining and switch.connected() ]
+            for switch in connected:
+                info( '%s ' % switch )
+            remaining.difference_update( connected )
             if not remaining:
                 info( '\n' )
                 return True
@@ -210,12 +233,12 @@ def waitConnected( self, timeout=None, delay=.5 ):
             sleep( delay )
             time += delay
         warn( 'Timed out after %d seconds\n' % time )
-        for switch in remaining:
-            if not switch.connected():
+        remaining.difference_update(
+            [ switch for switch in remaining if switch.connected() ] )
+        for switch in self.switches:
+            if switch in remaining:
                 warn( 'Warning: %s is not connected to a controller\n'
                       % switch.name )
-            else:
-                remaining.remove( switch )
         return not remaining
 
     def getNextIp( self ):
@@ -231,6 +254,8 @@ def addHost( self, name, cls=None, **params ):
            cls: custom host class/constructor (optional)
            params: parameters for host
            returns: added host"""
+        # Interned names make nameToNode lookups from the CLI cheaper
+        name = intern( name )
         # Default IP and MAC addresses
         defaults = { 'ip': ipAdd( self.nextIP,
                                   ipBaseNum=self.ipBaseNum,
@@ -248,13 +273,14 @@ def addHost( self, name, cls=None, **params ):
         h = cls( name, **defaults )
         self.hosts.append( h )
         self.nameToNode[ name ] = h
+        self._nodes = None
         return h
 
     def removeHost( self, name, **params):
         """
         Remove a host from the network at runtime.
         """
-        if not isinstance( name, BaseString ) and name is not None:
+        if not isinstance( name, str ) and name is not None:
             name = name.name  # if we get a host object
         try:
             h = self.get(name)
@@ -266,6 +292,7 @@ def removeHost( self, name, **params):
                 self.hosts.remove(h)
             if name in self.nameToNode:
                 del self.nameToNode[name]
+            self._nodes = None
             h.stop( deleteIntfs=True )
             debug("Removed: %s\n" % name)
             return True
@@ -284,6 +311,7 @@ def delNode( self, node, nodes=None):
         node.terminate()
         nodes.remove( node )
         del self.nameToNode[ node.name ]
+        self._nodes = None
 
     def delHost( self, host ):
         "Delete a host"
@@ -295,16 +323,18 @@ def addSwitch( self, name, cls=None, **params ):
            cls: custom switch class/constructor (optional)
            returns: added switch
            side effect: increments listenPort ivar ."""
+        name = intern( name )
         defaults = { 'listenPort': self.listenPort,
                      'inNamespace': self.inNamespace }
-        defaults.update( params )
         if not cls:
             cls = self.switch
+        defaults.update( params )
         sw = cls( name, **defaults )
         if not self.inNamespace and self.listenPort:
             self.listenPort += 1
         self.switches.append( sw )
         self.nameToNode[ name ] = sw
+        self._nodes = None
         return sw
 
     def delSwitch( self, switch ):
@@ -325,11 +355,13 @@ def addController( self, name='c0', controller=None, **params ):
             name = controller_new.name
             # pylint: enable=maybe-no-member
         else:
+            name = intern( name )
             controller_new = controller( name, **params )
         # Add new controller to net
         if controller_new:  # allow controller-less setups
             self.controllers.append( controller_new )
             self.nameToNode[ name ] = controller_new
+            self._nodes = None
         return controller_new
 
     def delController( self, controller ):
@@ -383,27 +415,36 @@ def __delitem__( self, key ):
         "del net[ name ] operator - delete node with given name"
         self.delNode( self.nameToNode[ key ] )
 
+    def _nodeCache( self ):
+        """Return cached node names and nodes, rebuilding them if
+           nodes have been added or removed since the last call.
+           returns: ( names, nodes ) tuples of hosts, switches
+           and controllers, in that order"""
+        if self._nodes is None:
+            nodes = tuple( chain( self.hosts, self.switches,
+                                  self.controllers ) )
+            self._nodes = ( tuple( node.name for node in nodes ), nodes )
+        return self._nodes
+
     def __iter__( self ):
         "return iterator over node names"
-        for node in chain( self.hosts, self.switches, self.controllers ):
-            yield node.name
+        return iter( self._nodeCache()[ 0 ] )
 
     def __len__( self ):
         "returns number of nodes in net"
-        return ( len( self.hosts ) + len( self.switches ) +
-                 len( self.controllers ) )
+        return len( self._nodeCache()[ 1 ] )
 
     def __contains__( self, item ):
         "returns True if net contains named node"
         return item in self.nameToNode
 
     def keys( self ):
-        "return a list of all node names or net's keys"
-        return list( self )
+        "return a tuple of all node names or net's keys"
+        return self._nodeCache()[ 0 ]
 
     def values( self ):
-        "return a list of all nodes or net's values"
-        return [ self[name] for name in self ]
+        "return a tuple of all nodes or net's values"
+        return self._nodeCache()[ 1 ]
 
     def items( self ):
         "return (key,value) tuple list for every node in net"
@@ -412,8 +453,10 @@ def items( self ):
     @staticmethod
     def randMac():
         "Return a random, non-multicast MAC address"
-        return macColonHex( random.randint(1, 2**48 - 1) & 0xfeffffffffff |
-                            0x020000000000 )
+        mac = bytearray( os.urandom( 6 ) )
+        # Clear the multicast bit and set the locally administered bit
+        mac[ 0 ] = ( mac[ 0 ] & 0xfe ) | 0x02
+        return ':'.join( '%02x' % byte for byte in mac )
 
     def addLink( self, node1, node2, port1=None, port2=None,
                  cls=None, **params ):
@@ -426,8 +469,8 @@ def addLink( self, node1, node2, port1=None, port2=None,
             params: additional link params (optional)
             returns: link object"""
         # Accept node objects or names
-        node1 = node1 if not isinstance( node1, BaseString ) else self[ node1 ]
-        node2 = node2 if not isinstance( node2, BaseString ) else self[ node2 ]
+        node1 = node1 if not isinstance( node1, str ) else self[ node1 ]
+        node2 = node2 if not isinstance( node2, str ) else self[ node2 ]
         options = dict( params )
         # Port is optional
         if port1 is not None:
@@ -444,12 +487,17 @@ def addLink( self, node1, node2, port1=None, port2=None,
 
         # Allow to add links at runtime
         # (needs attach method provided by OVSSwitch)
-        if isinstance( node1, OVSSwitch ):
-            node1.attach(link.intf1)
-        if isinstance( node2, OVSSwitch ):
-            node2.attach(link.intf2)
+        # Before the network is built, switches are not running yet and
+        # their start() adds all ports in a single ovs-vsctl transaction
+        if self.built:
+            if isinstance( node1, OVSSwitch ):
+                node1.attach(link.intf1)
+            if isinstance( node2, OVSSwitch ):
+                node2.attach(link.intf2)
 
         self.links.append( link )
+        self._linkIndex.setdefault( frozenset( ( node1, node2 ) ),
+                                    [] ).append( link )
         return link
 
     def removeLink(self, link=None, node1=None, node2=None):
@@ -458,8 +506,8 @@ def removeLink(self, link=None, node1=None, node2=None):
         or the nodes the link connects.
         """
         if link is None:
-            if (isinstance( node1, BaseString )
-                    and isinstance( node2, BaseString )):
+            if (isinstance( node1, str )
+                    and isinstance( node2, str )):
                 try:
                     node1 = self.get(node1)
                 except:
@@ -469,31 +517,30 @@ def removeLink(self, link=None, node1=None, node2=None):
                 except:
                     error("Host: %s not found.\n" % node2)
             # try to find link by nodes
-            for l in self.links:
-                if l.intf1.node == node1 and l.intf2.node == node2:
-                    link = l
-                    break
-                if l.intf1.node == node2 and l.intf2.node == node1:
-                    link = l
-                    break
+            links = self.linksBetween( node1, node2 )
+            if links:
+                link = links[ 0 ]
         if link is None:
             error("Couldn't find link to be removed.\n")
             return
         # tear down the link
-        link.delete()
-        self.links.remove(link)
+        self.delLink( link )
 
     def delLink( self, link ):
         "Remove a link from this network"
+        key = frozenset( ( link.intf1.node, link.intf2.node ) )
         link.delete()
         self.links.remove( link )
+        links = self._linkIndex.get( key, [] )
+        if link in links:
+            links.remove( link )
+            if not links:
+                del self._linkIndex[ key ]
 
     def linksBetween( self, node1, node2 ):
         "Return Links between node1 and node2"
-        return [ link for link in self.links
-                 if ( node1, node2 ) in (
-                    ( link.intf1.node, link.intf2.node ),
-                    ( link.intf2.node, link.intf1.node ) ) ]
+        return list( self._linkIndex.get( frozenset( ( node1, node2 ) ),
+                                          [] ) )
 
     def delLinkBetween( self, node1, node2, index=0, allLinks=False ):
         """Delete link(s) between node1 and node2
@@ -509,11 +556,12 @@ def delLinkBetween( self, node1, node2, index=0, allLinks=False ):
 
     def configHosts( self ):
         "Configure a set of hosts."
-        for host in self.hosts:
-            info( host.name + ' ' )
+        def configHost( host ):
+            "Configure a single host"
             intf = host.defaultIntf()
             if intf:
-                host.configDefault()
+                # Use a single ip -batch per host if we can
+                getattr( host, 'configDefaultBatch', host.configDefault )()
             else:
                 # Don't configure nonexistent intf
                 host.configDefault( ip=None, mac=None )
@@ -523,6 +571,11 @@ def configHosts( self ):
             # quietRun( 'renice +18 -p ' + repr( host.pid ) )
             # This may not be the right place to do this, but
             # it needs to be done somewhere.
+        for host in self.hosts:
+            info( host.name + ' ' )
+        # Each host is configured through its own shell, so
+        # we can configure all of them concurrently
+        runParallel( configHost, self.hosts )
         info( '\n' )
 
     def buildFromTopo( self, topo=None ):
@@ -537,6 +590,11 @@ def buildFromTopo( self, topo=None ):
 
         info( '*** Creating network\n' )
 
+        # Query the topo once; links() sorts on every call
+        hostNames = tuple( topo.hosts() )
+        switchNames = tuple( topo.switches() )
+        links = tuple( topo.links( sort=True, withInfo=True ) )
+
         if not self.controllers and self.controller:
             # Add a default controller
             info( '*** Adding controller\n' )
@@ -551,23 +609,18 @@ def buildFromTopo( self, topo=None ):
                     self.addController( 'c%d' % i, cls )
 
         info( '*** Adding hosts:\n' )
-        for hostName in topo.hosts():
+        for hostName in hostNames:
             self.addHost( hostName, **topo.nodeInfo( hostName ) )
             info( hostName + ' ' )
 
         info( '\n*** Adding switches:\n' )
-        for switchName in topo.switches():
-            # A bit ugly: add batch parameter if appropriate
+        for switchName in switchNames:
             params = topo.nodeInfo( switchName)
-            cls = params.get( 'cls', self.switch )
-            #if hasattr( cls, 'batchStartup' ):
-            #    params.setdefault( 'batch', True )
             self.addSwitch( switchName, **params )
             info( switchName + ' ' )
 
         info( '\n*** Adding links:\n' )
-        for srcName, dstName, params in topo.links(
-                sort=True, withInfo=True ):
+        for srcName, dstName, params in links:
             self.addLink( **params )
             info( '(%s, %s) ' % ( srcName, dstName ) )
 
@@ -605,16 +658,22 @@ def startTerms( self ):
 
     def stopXterms( self ):
         "Kill each xterm."
+        # Signal them all first so that they exit in parallel,
+        # then reap them so they don't linger as zombies
         for term in self.terms:
             os.kill( term.pid, signal.SIGKILL )
+        for term in self.terms:
+            term.wait()
+        self.terms = []
         cleanUpScreens()
 
     def staticArp( self ):
         "Add all-pairs ARP entries to remove the need to handle broadcast."
+        # Look up each host's addresses once rather than once per source
+        addrs = [ ( host, host.IP(), host.MAC() ) for host in self.hosts ]
         for src in self.hosts:
-            for dst in self.hosts:
-                if src != dst:
-                    src.setARP( ip=dst.IP(), mac=dst.MAC() )
+            src.setARPBatch( [ ( ip, mac ) for dst, ip, mac in addrs
+                               if dst is not src ] )
 
     def start( self ):
         "Start controller and switches."
@@ -623,12 +682,16 @@ def start( self ):
         info( '*** Starting controller\n' )
         for controller in self.controllers:
             info( controller.name + ' ')
-            controller.start()
+        # Controllers must be running before switches connect
+        runParallel( lambda c: c.start(), self.controllers )
         info( '\n' )
         info( '*** Starting %s switches\n' % len( self.switches ) )
         for switch in self.switches:
             info( switch.name + ' ')
-            switch.start( self.controllers )
+            # Queue the switch's commands, batchStartup() runs them together
+            if hasattr( switch, 'batchStartup' ):
+                switch.batch = True
+        runParallel( lambda s: s.start( self.controllers ), self.switches )
         started = {}
         for swclass, switches in groupby(
                 sorted( self.switches,
@@ -646,12 +709,13 @@ def stop( self ):
         info( '*** Stopping %i controllers\n' % len( self.controllers ) )
         for controller in self.controllers:
             info( controller.name + ' ' )
-            controller.stop()
+        runParallel( lambda c: c.stop(), self.controllers )
         info( '\n' )
         if self.terms:
             info( '*** Stopping %i terms\n' % len( self.terms ) )
             self.stopXterms()
         info( '*** Stopping %i links\n' % len( self.links ) )
+        # Links share their nodes' shells, so we stop them serially
         for link in self.links:
             info( '.' )
             link.stop()
@@ -665,16 +729,19 @@ def stop( self ):
             if hasattr( swclass, 'batchShutdown' ):
                 success = swclass.batchShutdown( switches )
                 stopped.update( { s: s for s in success } )
-        for switch in self.switches:
-            info( switch.name + ' ' )
+        def stopSwitch( switch ):
+            "Stop and terminate a single switch"
             if switch not in stopped:
                 switch.stop()
             switch.terminate()
+        for switch in self.switches:
+            info( switch.name + ' ' )
+        runParallel( stopSwitch, self.switches )
         info( '\n' )
         info( '*** Stopping %i hosts\n' % len( self.hosts ) )
         for host in self.hosts:
             info( host.name + ' ' )
-            host.terminate()
+        runParallel( lambda h: h.terminate(), self.hosts )
         info( '\n*** Done\n' )
 
 
@@ -694,33 +761,110 @@ def monitor( self, hosts=None, timeoutms=-1 ):
            returns: iterator which returns host, line"""
         if hosts is None:
             hosts = self.hosts
-        poller = select.poll()
+        # epoll keeps the fd set in the kernel, so each wakeup costs
+        # O(ready fds) rather than O(hosts)
+        poller = select.epoll()
         h1 = hosts[ 0 ]  # so we can call class method fdToNode
         for host in hosts:
-            poller.register( host.stdout )
-        while True:
-            ready = poller.poll( timeoutms )
-            for fd, event in ready:
-                host = h1.fdToNode( fd )
-                if event & select.POLLIN:
-                    line = host.readline()
-                    if line is not None:
-                        yield host, line
-            # Return if non-blocking
-            if not ready and timeoutms >= 0:
-                yield None, None
+            poller.register( host.stdout, select.EPOLLIN )
+        timeout = timeoutms / 1000.0 if timeoutms >= 0 else -1
+        try:
+            while True:
+                ready = poller.poll( timeout )
+                for fd, event in ready:
+                    host = h1.fdToNode( fd )
+                    if event & select.EPOLLIN:
+                        line = host.readline()
+                        if line is not None:
+                            yield host, line
+                # Return if non-blocking
+                if not ready and timeoutms >= 0:
+                    yield None, None
+        finally:
+            poller.close()
 
     # XXX These test methods should be moved out of this class.
     # Probably we should create a tests.py for them
 
+    # pingFull sends two echo requests, so that the RTT of the second
+    # one is not inflated by ARP resolution; interval between them in
+    # seconds (values below 0.2 require root)
+    pingInterval = .2
+
+    # Maximum number of fping targets per command, to stay well below
+    # the line length limit of the node's pty
+    fpingMaxTargets = 128
+
+    def _pingHosts( self, hosts, timeout=None, manualdestip=None,
+                    useFping=False, count=1 ):
+        """Ping from each host to all other hosts (or manualdestip).
+           Each source pings through its own shell, so all sources
+           run concurrently.
+           hosts: list of hosts
+           timeout: time to wait for a response, as string
+           manualdestip: sends pings from each h in hosts to manualdestip
+           useFping: sources which have fping ping all of their targets
+                     in parallel with a single fping command; its
+                     output only suits reachability tests
+           count: number of echo requests sent by ping
+           returns: [ ( src, [ ( dest, ping output ) ] ) ] in host order;
+                    ping output is None if dest has no interfaces"""
+        opts = '-c%d' % count
+        if count > 1:
+            opts += ' -i %s' % self.pingInterval
+        if timeout:
+            opts += ' -W %s' % timeout
+
+        def pingFrom( node ):
+            "Ping all targets from node"
+            if manualdestip is not None:
+                targets = [ ( manualdestip, manualdestip ) ]
+            else:
+                targets = [ ( dest, dest.IP() if dest.intfs else None )
+                            for dest in hosts if node != dest ]
+            if useFping and manualdestip is None and self.hasFping( node ):
+                return fpingFrom( node, targets )
+            results = []
+            for dest, ip in targets:
+                result = None
+                if ip is not None:
+                    result = node.cmd( 'LANG=C ping %s %s' % ( opts, ip ) )
+                results.append( ( dest, result ) )
+            return results
+
+        def fpingFrom( node, targets ):
+            "Ping all targets from node using fping"
+            fopts = ''
+            if timeout:
+                fopts = '-t %d' % ( float( timeout ) * 1000 )
+            ips = [ ip for _dest, ip in targets if ip is not None ]
+            lines = {}
+            for i in range( 0, len( ips ), self.fpingMaxTargets ):
+                chunk = ips[ i : i + self.fpingMaxTargets ]
+                result = node.cmd( 'fping -c1 -q %s %s 2>&1' %
+                                   ( fopts, ' '.join( chunk ) ) )
+                for line in result.splitlines():
+                    if _FPING_RE.search( line ):
+                        lines[ line.split( ':' )[ 0 ].strip() ] = line
+            return [ ( dest, lines.get( ip, '' ) if ip is not None else None )
+                     for dest, ip in targets ]
+
+        return list( zip( hosts, runParallel( pingFrom, hosts ) ) )
+
+    def hasFping( self, node ):
+        """Is fping available on node? (cached)
+           node: node to check"""
+        if node not in self._hasFping:
+            self._hasFping[ node ] = bool( node.cmd( 'which fping' ).strip() )
+        return self._hasFping[ node ]
+
     @staticmethod
     def _parsePing( pingOutput ):
         "Parse ping output and return packets sent, received."
         # Check for downed link
         if 'connect: Network is unreachable' in pingOutput:
             return 1, 0
-        r = r'(\d+) packets transmitted, (\d+)( packets)? received'
-        m = re.search( r, pingOutput )
+        m = _PING_RE.search( pingOutput ) or _FPING_RE.search( pingOutput )
         if m is None:
             error( '*** Error: could not parse ping output: %s\n' %
                    pingOutput )
@@ -741,15 +885,14 @@ def ping( self, hosts=None, timeout=None, manualdestip=None ):
         if not hosts:
             hosts = self.hosts
             output( '*** Ping: testing ping reachability\n' )
-        for node in hosts:
-            output( '%s -> ' % node.name )
-            if manualdestip is not None:
-                opts = ''
-                if timeout:
-                    opts = '-W %s' % timeout
-                result = node.cmd( 'LANG=c ping -c1 %s %s' %
-                                   (opts, manualdestip) )
-                sent, received = self._parsePing( result )
+        for node, results in self._pingHosts( hosts, timeout, manualdestip,
+                                              useFping=True ):
+            row = [ '%s -> ' % node.name ]
+            for target, result in results:
+                if result is not None:
+                    sent, received = self._parsePing( result )
+                else:
+                    sent, received = 0, 0
                 packets += sent
                 if received > sent:
                     error( '*** Error: received too many packets' )
@@ -757,28 +900,8 @@ def ping( self, hosts=None, timeout=None, manualdestip=None ):
                     node.cmdPrint( 'route' )
                     exit( 1 )
                 lost += sent - received
-                output( ( '%s ' % manualdestip ) if received else 'X ' )
-            else:
-                for dest in hosts:
-                    if node != dest:
-                        opts = ''
-                        if timeout:
-                            opts = '-W %s' % timeout
-                        if dest.intfs:
-                            result = node.cmd( 'LANG=C ping -c1 %s %s' %
-                                                (opts, dest.IP()) )
-                            sent, received = self._parsePing( result )
-                        else:
-                            sent, received = 0, 0
-                        packets += sent
-                        if received > sent:
-                            error( '*** Error: received too many packets' )
-                            error( '%s' % result )
-                            node.cmdPrint( 'route' )
-                            exit( 1 )
-                        lost += sent - received
-                        output( ( '%s ' % dest.name ) if received else 'X ' )
-            output( '\n' )
+                row.append( ( '%s ' % target ) if received else 'X ' )
+            output( ''.join( row ) + '\n' )
         if packets > 0:
             ploss = 100.0 * lost / packets
             received = packets - lost
@@ -794,20 +917,16 @@ def _parsePingFull( pingOutput ):
         "Parse ping output and return all data."
         errorTuple = (1, 0, 0, 0, 0, 0)
         # Check for downed link
-        r = r'[uU]nreachable'
-        m = re.search( r, pingOutput )
+        m = _PING_UNREACH_RE.search( pingOutput )
         if m is not None:
             return errorTuple
-        r = r'(\d+) packets transmitted, (\d+)( packets)? received'
-        m = re.search( r, pingOutput )
+        m = _PING_RE.search( pingOutput )
         if m is None:
             error( '*** Error: could not parse ping output: %s\n' %
                    pingOutput )
             return errorTuple
         sent, received = int( m.group( 1 ) ), int( m.group( 2 ) )
-        r = r'rtt min/avg/max/mdev = '
-        r += r'(\d+\.\d+)/(\d+\.\d+)/(\d+\.\d+)/(\d+\.\d+) ms'
-        m = re.search( r, pingOutput )
+        m = _PING_RTT_RE.search( pingOutput )
         if m is None:
             if received == 0:
                 return errorTuple
@@ -818,6 +937,15 @@ def _parsePingFull( pingOutput ):
         rttavg = float( m.group( 2 ) )
         rttmax = float( m.group( 3 ) )
         rttdev = float( m.group( 4 ) )
+        # Report the RTT without the first reply, which may include
+        # ARP resolution, if any later reply was received
+        rtts = [ float( t ) for seq, t in _PING_REPLY_RE.findall( pingOutput )
+                 if int( seq ) > 1 ]
+        if rtts:
+            rttmin, rttmax = min( rtts ), max( rtts )
+            rttavg = sum( rtts ) / len( rtts )
+            rttdev = sqrt( sum( ( t - rttavg ) ** 2 for t in rtts )
+                           / len( rtts ) )
         return sent, received, rttmin, rttavg, rttmax, rttdev
 
     def pingFull( self, hosts=None, timeout=None, manualdestip=None ):
@@ -831,36 +959,26 @@ def pingFull( self, hosts=None, timeout=None, manualdestip=None ):
         if not hosts:
             hosts = self.hosts
             output( '*** Ping: testing ping reachability\n' )
-        for node in hosts:
-            output( '%s -> ' % node.name )
-            if manualdestip is not None:
-                opts = ''
-                if timeout:
-                    opts = '-W %s' % timeout
-                result = node.cmd( 'ping -c1 %s %s' % (opts, manualdestip) )
-                outputs = self._parsePingFull( result )
+        for node, results in self._pingHosts( hosts, timeout, manualdestip,
+                                              count=2 ):
+            row = [ '%s -> ' % node.name ]
+            for dest, result in results:
+                if result is not None:
+                    outputs = self._parsePingFull( result )
+                else:
+                    outputs = ( 1, 0, 0, 0, 0, 0 )
                 sent, received, rttmin, rttavg, rttmax, rttdev = outputs
-                all_outputs.append( (node, manualdestip, outputs) )
-                output( ( '%s ' % manualdestip ) if received else 'X ' )
-                output( '\n' )
-            else:
-                for dest in hosts:
-                    if node != dest:
-                        opts = ''
-                        if timeout:
-                            opts = '-W %s' % timeout
-                        result = node.cmd( 'ping -c1 %s %s' % (opts, dest.IP()) )
-                        outputs = self._parsePingFull( result )
-                        sent, received, rttmin, rttavg, rttmax, rttdev = outputs
-                        all_outputs.append( (node, dest, outputs) )
-                        output( ( '%s ' % dest.name ) if received else 'X ' )
-        output( "*** Results: \n" )
+                all_outputs.append( (node, dest, outputs) )
+                row.append( ( '%s ' % dest ) if received else 'X ' )
+            output( ''.join( row ) + '\n' )
+        lines = [ "*** Results: \n" ]
         for outputs in all_outputs:
             src, dest, ping_outputs = outputs
             sent, received, rttmin, rttavg, rttmax, rttdev = ping_outputs
-            output( " %s->%s: %s/%s, " % (src, dest, sent, received ) )
-            output( "rtt min/avg/max/mdev %0.3f/%0.3f/%0.3f/%0.3f ms\n" %
-                    (rttmin, rttavg, rttmax, rttdev) )
+            lines.append( " %s->%s: %s/%s, " % (src, dest, sent, received ) +
+                          "rtt min/avg/max/mdev %0.3f/%0.3f/%0.3f/%0.3f ms\n" %
+                          (rttmin, rttavg, rttmax, rttdev) )
+        output( ''.join( lines ) )
         return all_outputs
 
     def pingAll( self, timeout=None ):
@@ -890,8 +1008,7 @@ def _parseIperf( iperfOutput ):
         """Parse iperf output and return bandwidth.
            iperfOutput: string
            returns: result string"""
-        r = r'([\d\.]+ \w+/sec)'
-        m = re.findall( r, iperfOutput )
+        m = _IPERF_RATE_RE.findall( iperfOutput )
         if m:
             return m[-1]
         else:
@@ -919,32 +1036,44 @@ def iperf( self, hosts=None, l4Type='TCP', udpBw='10M', fmt=None,
         client, server = hosts
         output( '*** Iperf: testing', l4Type, 'bandwidth between',
                 client, 'and', server, '\n' )
-        server.cmd( 'killall -9 iperf' )
-        iperfArgs = 'iperf -p %d ' % port
-        bwArgs = ''
-        if l4Type == 'UDP':
-            iperfArgs += '-u '
-            bwArgs = '-b ' + udpBw + ' '
-        elif l4Type != 'TCP':
+        if l4Type not in ( 'TCP', 'UDP' ):
             raise Exception( 'Unexpected l4 type: %s' % l4Type )
-        if fmt:
-            iperfArgs += '-f %s ' % fmt
+        udp = l4Type == 'UDP'
+        serverIP = server.IP()
+        iperfArgs = 'iperf -p %d %s%s' % ( port, '-u ' if udp else '',
+                                           '-f %s ' % fmt if fmt else '' )
+        clientCmd = '%s-t %d -c %s %s' % ( iperfArgs, seconds, serverIP,
+                                           '-b %s ' % udpBw if udp else '' )
+        # only clean up after an iperf() run which did not finish
+        if server in self._iperfServers:
+            server.cmd( 'killall -9 iperf' )
+        self._iperfServers.add( server )
         server.sendCmd( iperfArgs + '-s' )
-        if l4Type == 'TCP':
-            if not waitListening( client, server.IP(), port ):
+        if not udp:
+            if not waitListening( client, serverIP, port ):
                 raise Exception( 'Could not connect to iperf on port %d'
                                  % port )
-        cliout = client.cmd( iperfArgs + '-t %d -c ' % seconds +
-                             server.IP() + ' ' + bwArgs )
+        cliout = client.cmd( clientCmd )
         debug( 'Client output: %s\n' % cliout )
         servout = ''
         # We want the last *b/sec from the iperf server output
         # for TCP, there are two of them because of waitListening
         count = 2 if l4Type == 'TCP' else 1
-        while len( re.findall( '/sec', servout ) ) < count:
-            servout += server.monitor( timeoutms=5000 )
+        found = 0
+        while found < count:
+            chunk = server.monitor( timeoutms=200 )
+            # Only scan the new chunk, plus enough of the previous output
+            # to catch a '/sec' split across reads
+            found += ( servout[ -3: ] + chunk ).count( '/sec' )
+            servout += chunk
+            if found < count and not server.waiting:
+                # e.g. the port is already taken by another iperf
+                self._iperfServers.discard( server )
+                raise Exception( 'iperf server on %s exited: %s'
+                                 % ( server, servout ) )
         server.sendInt()
         servout += server.waitOutput()
+        self._iperfServers.discard( server )
         debug( 'Server output: %s\n' % servout )
         result = [ self._parseIperf( servout ), self._parseIperf( cliout ) ]
         if l4Type == 'UDP':
@@ -966,30 +1095,37 @@ def runCpuLimitTest( self, cpu, duration=5 ):
         num_procs = int( ceil( cores * cpu ) )
         pids = {}
         for h in hosts:
-            pids[ h ] = []
-            for _core in range( num_procs ):
-                h.cmd( 'while true; do a=1; done &' )
-                pids[ h ].append( h.cmd( 'echo $!' ).strip() )
+            # spawn all loops at once; the PIDs are echoed on the last line
+            out = h.cmd( 'pids=""; for i in $(seq 1 %d); do '
+                         'while true; do a=1; done & pids="$pids $!"; '
+                         'done; echo $pids' % num_procs )
+            lines = out.strip().splitlines()
+            pids[ h ] = lines[ -1 ].split() if lines else []
         outputs = {}
         time = {}
-        # get the initial cpu time for each host
-        for host in hosts:
-            outputs[ host ] = []
-            with open( '/sys/fs/cgroup/cpuacct/%s/cpuacct.usage' %
-                       host, 'r' ) as f:
-                time[ host ] = float( f.read() )
-        for _ in range( duration ):
-            sleep( 1 )
+        # open each host's cpu usage file once and re-read it each tick
+        fds = {}
+        try:
             for host in hosts:
-                with open( '/sys/fs/cgroup/cpuacct/%s/cpuacct.usage' %
-                           host, 'r' ) as f:
-                    readTime = float( f.read() )
-                outputs[ host ].append( ( ( readTime - time[ host ] )
-                                        / 1000000000 ) / cores * 100 )
-                time[ host ] = readTime
-        for h, pids in pids.items():
-            for pid in pids:
-                h.cmd( 'kill -9 %s' % pid )
+                fds[ host ] = os.open( '/sys/fs/cgroup/cpuacct/%s/'
+                                       'cpuacct.usage' % host, os.O_RDONLY )
+            # get the initial cpu time for each host
+            for host in hosts:
+                outputs[ host ] = []
+                time[ host ] = float( os.pread( fds[ host ], 64, 0 ) )
+            for _ in range( duration ):
+                sleep( 1 )
+                for host in hosts:
+                    readTime = float( os.pread( fds[ host ], 64, 0 ) )
+                    outputs[ host ].append( ( ( readTime - time[ host ] )
+                                            / 1000000000 ) / cores * 100 )
+                    time[ host ] = readTime
+        finally:
+            for fd in fds.values():
+                os.close( fd )
+        for h, hpids in pids.items():
+            if hpids:
+                h.cmd( 'kill -9 %s' % ' '.join( hpids ) )
         cpu_fractions = []
         for _host, outputs in outputs.items():
             for pct in outputs:
@@ -1088,7 +1224,8 @@ def addExtSAP(self, sapName, sapIP, dpid=None, **params):
         return SAPswitch
 
     def removeExtSAP(self, sapName):
-        SAPswitch = self.SAPswitches[sapName]
+        # drop it from the index so stop() does not remove its rules again
+        SAPswitch = self.SAPswitches.pop(sapName)
         info( 'stopping external SAP:' + SAPswitch.name + ' \n' )
         SAPswitch.stop()
         SAPswitch.terminate()
@@ -1103,54 +1240,101 @@ def addSAPNAT(self, SAPSwitch):
         :param SAPNet: Subnet of the external SAP as str (eg. '10.10.1.0/30')
         :return:
         """
-        SAPip = SAPSwitch.ip
-        SAPNet = str(ipaddress.IPv4Network(unicode(SAPip), strict=False))
         # due to a bug with python-iptables, removing and finding rules does not succeed when the mininet CLI is running
         # so we use the iptables tool
-        # create NAT rule
-        rule0_ = "iptables -t nat -A POSTROUTING ! -o {0} -s {1} -j MASQUERADE".format(SAPSwitch.deployed_name, SAPNet)
-        p = Popen(shlex.split(rule0_))
-        p.communicate()
-
-        # create FORWARD rule
-        rule1_ = "iptables -A FORWARD -o {0} -j ACCEPT".format(SAPSwitch.deployed_name)
-        p = Popen(shlex.split(rule1_))
-        p.communicate()
-
-        rule2_ = "iptables -A FORWARD -i {0} -j ACCEPT".format(SAPSwitch.deployed_name)
-        p = Popen(shlex.split(rule2_))
-        p.communicate()
-
+        # create NAT and FORWARD rules
+        SAPNet = self._updateSAPNAT(SAPSwitch, '-A')
         info("added SAP NAT rules for: {0} - {1}\n".format(SAPSwitch.name, SAPNet))
 
 
     def removeSAPNAT(self, SAPSwitch):
 
-        SAPip = SAPSwitch.ip
-        SAPNet = str(ipaddress.IPv4Network(unicode(SAPip), strict=False))
         # due to a bug with python-iptables, removing and finding rules does not succeed when the mininet CLI is running
         # so we use the iptables tool
-        rule0_ = "iptables -t nat -D POSTROUTING ! -o {0} -s {1} -j MASQUERADE".format(SAPSwitch.deployed_name, SAPNet)
-        p = Popen(shlex.split(rule0_))
-        p.communicate()
+        SAPNet = self._updateSAPNAT(SAPSwitch, '-D')
+        info("remove SAP NAT rules for: {0} - {1}\n".format(SAPSwitch.name, SAPNet))
 
-        rule1_ = "iptables -D FORWARD -o {0} -j ACCEPT".format(SAPSwitch.deployed_name)
-        p = Popen(shlex.split(rule1_))
-        p.communicate()
 
-        rule2_ = "iptables -D FORWARD -i {0} -j ACCEPT".format(SAPSwitch.deployed_name)
-        p = Popen(shlex.split(rule2_))
-        p.communicate()
+    # Does iptables-restore support --wait (iptables >= 1.6.2)?
+    # None until probed, see _iptablesRestoreCmd()
+    iptablesRestoreWait = None
 
-        info("remove SAP NAT rules for: {0} - {1}\n".format(SAPSwitch.name, SAPNet))
+    @classmethod
+    def _iptablesRestoreCmd(cls):
+        """
+        Return the iptables-restore command used to update SAP NAT rules
+        :return: argument list, with --wait if iptables-restore supports it
+        """
+        if cls.iptablesRestoreWait is None:
+            # an empty --noflush restore is a no-op, so use it as a probe
+            try:
+                p = Popen(['iptables-restore', '--noflush', '--wait'],
+                          stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL)
+                p.communicate(input=b'')
+                cls.iptablesRestoreWait = p.returncode == 0
+            except OSError:
+                cls.iptablesRestoreWait = False
+        cmd = ['iptables-restore', '--noflush']
+        if cls.iptablesRestoreWait:
+            # wait for the xtables lock, SAPs may be updated concurrently
+            cmd.append('--wait')
+        return cmd
+
+    @classmethod
+    def _updateSAPNAT(cls, SAPSwitch, action):
+        """
+        Add or delete the NAT and FORWARD rules of an external SAP with a single iptables-restore call
+        :param SAPSwitch: Instance of the external SAP switch
+        :param action: '-A' to add or '-D' to delete the rules
+        :return: subnet of the external SAP as str
+        """
+        # remember the subnet the rules were added for, so that they are
+        # removed with exactly the same arguments
+        SAPNet = getattr(SAPSwitch, '_sap_net', None)
+        if SAPNet is None:
+            SAPNet = SAPSwitch._sap_net = str(ipaddress.IPv4Network(SAPSwitch.ip, strict=False))
+        name = SAPSwitch.deployed_name
+        rules = [('nat', ['POSTROUTING', '!', '-o', name, '-s', SAPNet, '-j', 'MASQUERADE']),
+                 ('filter', ['FORWARD', '-o', name, '-j', 'ACCEPT']),
+                 ('filter', ['FORWARD', '-i', name, '-j', 'ACCEPT'])]
+        # iptables-restore commits each table separately, so remember
+        # the last input line of each table to know what was committed
+        batch, tables = '', []
+        for table, rulesOfTable in groupby(rules, key=lambda rule: rule[0]):
+            rulesOfTable = [rule for _table, rule in rulesOfTable]
+            batch += '*%s\n' % table
+            batch += ''.join('%s %s\n' % (action, ' '.join(rule)) for rule in rulesOfTable)
+            batch += 'COMMIT\n'
+            tables.append((table, rulesOfTable, batch.count('\n')))
+        try:
+            p = Popen(cls._iptablesRestoreCmd(), stdin=PIPE, stderr=PIPE)
+            _, err = p.communicate(input=batch.encode())
+        except OSError as e:
+            err = str(e)
+        else:
+            if p.returncode == 0:
+                return SAPNet
+            err = err.decode(errors='replace')
+        debug('iptables-restore failed: %s\n' % err.strip())
+        # Retry the tables which were not committed one rule at a time.
+        # If iptables-restore could not run at all (e.g. missing or
+        # xtables lock busy), no table was committed.
+        m = _IPTABLES_RESTORE_ERR_RE.search(err)
+        failedLine = int(m.group(1)) if m else 0
+        for table, rulesOfTable, lastLine in tables:
+            if lastLine < failedLine:
+                continue
+            for rule in rulesOfTable:
+                call(['iptables', '--wait', '-t', table, action] + rule)
+        return SAPNet
 
 
     def stop(self):
         super(Containernet, self).stop()
 
         info('*** Removing NAT rules of %i SAPs\n' % len(self.SAPswitches))
-        for SAPswitch in self.SAPswitches:
-            self.removeSAPNAT(self.SAPswitches[SAPswitch])
+        # each SAP has its own rules, so they can be removed concurrently
+        runParallel(self.removeSAPNAT, list(self.SAPswitches.values()), maxWorkers=16)
         info("\n")
 
 
@@ -1198,6 +1382,7 @@ def configureRoutedControlNetwork( self, ip='192.168.123.1',
         info( controller.name + ' <->' )
         cip = ip
         snum = ipParse( ip )
+        sconfig, intfs = [], []
         for switch in self.switches:
             info( ' ' + switch.name )
             link = self.link( switch, controller, port1=0 )
@@ -1207,19 +1392,32 @@ def configureRoutedControlNetwork( self, ip='192.168.123.1',
             while snum & 0xff in [ 0, 255 ]:
                 snum += 1
             sip = ipStr( snum )
+            # the controller side shares one shell, so configure it here
             cintf.setIP( cip, prefixLen )
-            sintf.setIP( sip, prefixLen )
             controller.setHostRoute( sip, cintf )
+            sconfig.append( ( switch, sintf, sip ) )
+            intfs += [ cintf, sintf ]
+
+        def configSwitch( config ):
+            "Configure the switch side of a control link"
+            switch, sintf, sip = config
+            sintf.setIP( sip, prefixLen )
             switch.setHostRoute( cip, sintf )
+
+        runParallel( configSwitch, sconfig )
         info( '\n' )
         info( '*** Testing control network\n' )
-        while not cintf.isUp():
-            info( '*** Waiting for', cintf, 'to come up\n' )
-            sleep( 1 )
+        waiting = None
+        while True:
+            down = [ intf for intf in intfs if not intf.isUp() ]
+            if not down:
+                break
+            if down != waiting:
+                info( '*** Waiting for', ' '.join( str( i ) for i in down ),
+                      'to come up\n' )
+                waiting = down
+            sleep( .1 )
         for switch in self.switches:
-            while not sintf.isUp():
-                info( '*** Waiting for', sintf, 'to come up\n' )
-                sleep( 1 )
             if self.ping( hosts=[ switch, controller ] ) != 0:
                 error( '*** Error: control network test failed\n' )
                 exit( 1 )
@@ -61,7 +61,7 @@
 import json
 from distutils.version import StrictVersion
 from re import findall
-from subprocess import Popen, PIPE, check_output
+from subprocess import Popen, PIPE, STDOUT, check_output
 from sys import exit  # pylint: disable=redefined-builtin
 from time import sleep
 
@@ -70,7 +70,7 @@
                            numCores, retry, mountCgroups, BaseString, decode,
                            encode, getincrementaldecoder, Python3, which )
 from mininet.moduledeps import moduleDeps, pathCheck, TUN
-from mininet.link import Link, Intf, TCIntf, OVSIntf
+from mininet.link import Link, Intf, TCIntf, OVSIntf, InternalPortIntf
 
 
 # pylint: disable=too-many-arguments
@@ -560,6 +560,48 @@ def setARP( self, ip, mac ):
         result = self.cmd( 'arp', '-s', ip, mac )
         return result
 
+    def setARPBatch( self, entries, intf=None ):
+        """Add several ARP entries with a single ip invocation.
+           entries: list of ( ip, mac ) string tuples
+           intf: intf or intf name (if None, the kernel picks the
+                 device for each entry like setARP() does)"""
+        # With several interfaces, the device of each entry depends on
+        # the route to its ip, so let arp -s pick it
+        if not self.ipBatchMode or ( intf is None and
+                                     len( self.intfs ) > 1 ):
+            return ''.join( self.setARP( ip, mac ) for ip, mac in entries )
+        intf = self.intf( intf )
+        if not intf:
+            return None
+        return self.ipBatch( 'neigh replace %s lladdr %s dev %s nud permanent'
+                             % ( ip, mac, intf ) for ip, mac in entries )
+
+    # Can ipBatch() feed commands to ip -batch through popen()?
+    # Cleared on nodes whose ip has no batch mode (e.g. BusyBox)
+    ipBatchMode = True
+
+    def ipBatch( self, cmds ):
+        """Run ip commands in our namespace using one ip -batch process,
+           or one by one through our shell if ip has no batch mode.
+           cmds: ip commands, without the leading 'ip'
+           returns: output of ip"""
+        cmds = list( cmds )
+        if self.ipBatchMode:
+            # -force: keep going if one of the commands fails
+            popen = self.popen( [ 'ip', '-force', '-batch', '-' ],
+                                stdin=PIPE, stdout=PIPE, stderr=STDOUT )
+            out, _err = popen.communicate(
+                encode( ''.join( cmd + '\n' for cmd in cmds ) ) )
+            out = decode( out )
+            # iproute2 reports each failed command as 'Command failed';
+            # any other failure means the batch itself was not accepted
+            if not popen.returncode or 'Command failed' in out:
+                return out
+            debug( '*** %s: ip -batch failed, falling back to single '
+                   'ip commands: %s\n' % ( self.name, out ) )
+            self.ipBatchMode = False
+        return ''.join( self.cmd( 'ip', cmd ) for cmd in cmds )
+
     def setHostRoute( self, ip, intf ):
         """Add route to host.
            ip: IP address as dotted decimal
@@ -705,7 +747,30 @@ def setup( cls ):
 
 class Host( Node ):
     "A host is simply a Node"
-    pass
+
+    def configDefaultBatch( self, **moreParams ):
+        """Configure with default parameters, like configDefault(), but
+           send all interface and route setup through one ip -batch.
+           Hosts which override config() or have no ip batch mode use
+           configDefault() instead."""
+        if type( self ).config is not Node.config or not self.ipBatchMode:
+            return self.configDefault( **moreParams )
+        self.params.update( moreParams )
+        mac, ip = self.params.get( 'mac' ), self.params.get( 'ip' )
+        defaultRoute = self.params.get( 'defaultRoute' )
+        cmds = []
+        if mac is not None:
+            cmds += self.intf().setMACCmds( mac )
+        if ip is not None:
+            cmds += self.intf().setIPCmds( ip, prefixLen=8 )
+        if defaultRoute is not None:
+            if isinstance( defaultRoute, BaseString ) and ' ' in defaultRoute:
+                params = defaultRoute
+            else:
+                params = 'dev %s' % defaultRoute
+            cmds += [ 'route del default', 'route add default ' + params ]
+        cmds.append( 'link set lo ' + self.params.get( 'lo', 'up' ) )
+        return self.ipBatch( cmds )
 
 
 class Docker ( Host ):
@@ -1029,6 +1094,10 @@ def sendCmd( self, *args, **kwargs ):
             return
         Host.sendCmd( self, *args, **kwargs )
 
+    # docker exec in popen() does not forward stdin, and the image's
+    # ip may lack batch mode, so send ip commands through the shell
+    ipBatchMode = False
+
     def popen( self, *args, **kwargs ):
         """Return a Popen() object in node's namespace
            args: Popen() args, single list, or string
@@ -1729,6 +1798,9 @@ def TCReapply( intf ):
 
     def attach( self, intf ):
         "Connect a data port"
+        if isinstance( intf, InternalPortIntf ):
+            # Internal ports are created on the bridge by their link
+            return
         self.vsctl( 'add-port', self.deployed_name, intf )
         self.cmd( 'ifconfig', intf, 'up' )
         self.TCReapply( intf )
@@ -1802,11 +1874,19 @@ def start( self, controllers ):
             raise Exception(
                 'OVS kernel switch does not work in a namespace' )
         int( self.dpid, 16 )  # DPID must be a hex string
+        # Internal ports already exist on our bridge (see InternalPortLink)
+        internal = [ intf for intf in self.intfList()
+                     if isinstance( intf, InternalPortIntf ) ]
         # Command to add interfaces
         intfs = ''.join( ' -- add-port %s %s' % ( self.deployed_name, intf ) +
                          self.intfOpts( intf )
                          for intf in self.intfList()
-                         if self.ports[ intf ] and not intf.IP() )
+                         if self.ports[ intf ] and not intf.IP()
+                         and intf not in internal )
+        if not self.isOldOVS():
+            intfs += ''.join( ' -- set Interface %s ofport_request=%s' %
+                              ( intf.portName(), self.ports[ intf ] )
+                              for intf in internal )
         # Command to create controller entries
         clist = [ ( self.deployed_name + c.name, '%s:%s:%d' %
                   ( c.protocol, c.IP(), c.port ) )
@@ -1821,12 +1901,16 @@ def start( self, controllers ):
                           for name, target in clist )
         # Controller ID list
         cids = ','.join( '@%s' % name for name, _target in clist )
-        # Try to delete any existing bridges with the same name
-        if not self.isOldOVS():
+        # Try to delete any existing bridges with the same name,
+        # unless that would also delete our internal ports
+        addbr = ' -- add-br %s'
+        if internal:
+            addbr = ' -- --may-exist add-br %s'
+        elif not self.isOldOVS():
             cargs += ' -- --if-exists del-br %s' % self.deployed_name
         # One ovs-vsctl command to rule them all!
         self.vsctl( cargs +
-                    ' -- add-br %s' % self.deployed_name +
+                    addbr % self.deployed_name +
                     ' -- set bridge %s controller=[%s]' % ( self.deployed_name, cids  ) +
                     self.bridgeOpts() +
                     intfs )
@@ -1857,8 +1941,8 @@ def batchStartup( cls, switches, run=errRun ):
                     run( cmds, shell=True )
                     cmds = 'ovs-vsctl'
                 cmds += ' ' + cmd
-                switch.cmds = []
-                switch.batch = False
+            switch.commands = []
+            switch.batch = False
         if cmds:
             run( cmds, shell=True )
         # Reapply link config if necessary...
@@ -1920,12 +2004,27 @@ def __init__( self, *args, **kwargs ):
     def start( self, controllers ):
         "Start bridge, ignoring controllers argument"
         OVSSwitch.start( self, controllers=[] )
+        # in batch mode the bridge only exists after batchStartup()
+        if not self.batch:
+            self.configIP()
 
+    def configIP( self ):
+        "Assign our ip address (if any) to the bridge"
         # assign an ip address to this switch, so it can connect to the host
         if self.ip:
             self.cmd('ip address add', self.ip, 'dev', self.deployed_name)
             self.cmd('ip link set', self.deployed_name, 'up')
 
+    @classmethod
+    def batchStartup( cls, switches, run=errRun ):
+        """Batch startup for OVS bridges; assigns their ip addresses
+           once the bridges have been created"""
+        batched = [ switch for switch in switches if switch.batch ]
+        switches = super( OVSBridge, cls ).batchStartup( switches, run=run )
+        for switch in batched:
+            switch.configIP()
+        return switches
+
     def connected( self ):
         "Are we forwarding yet?"
         if self.stp:
@@ -3,9 +3,11 @@
 import os
 import subprocess
 import docker
+from types import SimpleNamespace
+from unittest import mock
 from mininet.net import Containernet
 from mininet.node import Controller
-from mininet.link import TCLink
+from mininet.link import TCLink, InternalPortLink
 from mininet.topolib import TreeContainerNet
 from mininet.clean import cleanup
 
@@ -247,6 +249,28 @@ def testDockerMultipleInterfaces( self ):
         # stop Mininet network
         self.stopNet()
 
+    def testManualSwitchStart( self ):
+        """
+        h1 -- s1 -- h2, started with build() and switch.start()
+        """
+        # create network
+        self.createNet(nswitches=1, nhosts=2, ndockers=0)
+        # setup links
+        self.net.addLink(self.h[0], self.s[0])
+        self.net.build()
+        # a link added between build() and start()
+        self.net.addLink(self.h[1], self.s[0])
+        self.h[1].configDefault()
+        # start controllers and switches by hand instead of net.start()
+        for c in self.net.controllers:
+            c.start()
+        self.s[0].start(self.net.controllers)
+        self.net.waitConnected(timeout=10)
+        # check connectivity by using ping
+        self.assertTrue(self.net.pingAll() <= 0.0)
+        # stop Mininet network
+        self.stopNet()
+
 
 #@unittest.skip("disabled command execution tests for development")
 class testContainernetContainerCommandExecution( simpleTestTopology ):
@@ -477,6 +501,150 @@ def testCustomLoss( self ):
         self.stopNet()
 
 
+#@unittest.skip("disabled internal port link tests for development")
+class testContainernetInternalPortLinks( simpleTestTopology ):
+    """
+    Tests to check links using OVS internal ports.
+    """
+
+    def testHostSwitchHost( self ):
+        """
+        h0 --internal-- s0 --internal-- h1
+        """
+        # create network
+        self.createNet(nswitches=1, nhosts=2, ndockers=0)
+        # setup links
+        self.net.addLink(self.h[0], self.s[0], cls=InternalPortLink)
+        self.net.addLink(self.h[1], self.s[0], cls=InternalPortLink)
+        # start Mininet network
+        self.startNet()
+        # check that the host interfaces are internal ports of s0
+        ports = [str(h.intf()) for h in self.h]
+        listed = subprocess.check_output(
+            ["ovs-vsctl", "list-ports", "s0"]).decode().split()
+        for port in ports:
+            self.assertIn(port, listed)
+        # check connectivity by using ping
+        self.assertTrue(self.net.pingAll() <= 0.0)
+        # stop Mininet network
+        self.stopNet()
+        # check that the internal ports are gone
+        with open(os.devnull, 'w') as devnull:
+            listed = subprocess.check_output(
+                "ovs-vsctl list-ports s0; ovs-vsctl show",
+                stderr=devnull, shell=True).decode().split()
+        for port in ports:
+            # ovs-vsctl show may quote the names
+            self.assertNotIn(port, listed)
+            self.assertNotIn('"%s"' % port, listed)
+
+
+#@unittest.skip("disabled ping parsing tests for development")
+class testPingParsing( unittest.TestCase ):
+    """
+    Tests for parsing ping and fping output (no network needed).
+    """
+
+    PING_HEAD = "PING 10.0.0.2 (10.0.0.2) 56(84) bytes of data.\n"
+
+    def testFirstReplyExcluded( self ):
+        out = (self.PING_HEAD +
+               "64 bytes from 10.0.0.2: icmp_seq=1 ttl=64 time=3.21 ms\n"
+               "64 bytes from 10.0.0.2: icmp_seq=2 ttl=64 time=0.052 ms\n"
+               "\n--- 10.0.0.2 ping statistics ---\n"
+               "2 packets transmitted, 2 received, 0% packet loss, time 200ms\n"
+               "rtt min/avg/max/mdev = 0.052/1.631/3.210/1.579 ms\n")
+        self.assertEqual(Containernet._parsePingFull(out),
+                         (2, 2, 0.052, 0.052, 0.052, 0.0))
+        self.assertEqual(Containernet._parsePing(out), (2, 2))
+
+    def testSummaryFallback( self ):
+        # only the first reply arrived: use ping's own summary
+        out = (self.PING_HEAD +
+               "64 bytes from 10.0.0.2: icmp_seq=1 ttl=64 time=3.21 ms\n"
+               "\n--- 10.0.0.2 ping statistics ---\n"
+               "2 packets transmitted, 1 received, 50% packet loss, time 200ms\n"
+               "rtt min/avg/max/mdev = 3.210/3.210/3.210/0.000 ms\n")
+        self.assertEqual(Containernet._parsePingFull(out),
+                         (2, 1, 3.21, 3.21, 3.21, 0.0))
+
+    def testNoReply( self ):
+        out = (self.PING_HEAD +
+               "\n--- 10.0.0.2 ping statistics ---\n"
+               "2 packets transmitted, 0 received, 100% packet loss, time 1000ms\n")
+        self.assertEqual(Containernet._parsePingFull(out), (1, 0, 0, 0, 0, 0))
+        self.assertEqual(Containernet._parsePing(out), (2, 0))
+
+    def testFpingSummary( self ):
+        out = ("10.0.0.2 : xmt/rcv/%loss = 1/1/0%, "
+               "min/avg/max = 0.05/0.05/0.05")
+        self.assertEqual(Containernet._parsePing(out), (1, 1))
+        out = "10.0.0.3 : xmt/rcv/%loss = 1/0/100%"
+        self.assertEqual(Containernet._parsePing(out), (1, 0))
+
+
+#@unittest.skip("disabled SAP NAT rule tests for development")
+class testSAPNATRules( unittest.TestCase ):
+    """
+    Tests for the iptables-restore fallback of the SAP NAT rules
+    (iptables is mocked, no network needed).
+    """
+
+    def setUp(self):
+        self.restoreWait = Containernet.iptablesRestoreWait
+        Containernet.iptablesRestoreWait = False
+
+    def tearDown(self):
+        Containernet.iptablesRestoreWait = self.restoreWait
+
+    def retriedTables(self, returncode=1, stderr=b'', error=None):
+        """
+        Add the rules of a SAP with a mocked iptables-restore and
+        return the tables of the rules retried with iptables.
+        """
+        sap = SimpleNamespace(ip='10.10.1.1/30', deployed_name='sap.s1')
+        popen = mock.Mock(returncode=returncode)
+        popen.communicate.return_value = (None, stderr)
+        with mock.patch('mininet.net.Popen',
+                        side_effect=error, return_value=popen), \
+                mock.patch('mininet.net.call') as call:
+            self.assertEqual(Containernet._updateSAPNAT(sap, '-A'),
+                             '10.10.1.0/30')
+        tables = []
+        for args, _kwargs in call.call_args_list:
+            cmd = args[0]
+            self.assertEqual(cmd[cmd.index('-t') + 2], '-A')
+            tables.append(cmd[cmd.index('-t') + 1])
+        return tables
+
+    def testSuccess( self ):
+        self.assertEqual(self.retriedTables(returncode=0), [])
+
+    def testLegacyFilterFailed( self ):
+        # *nat is committed at line 3, *filter spans lines 4 to 7
+        self.assertEqual(self.retriedTables(
+            stderr=b'iptables-restore: line 7 failed\n'),
+            ['filter', 'filter'])
+
+    def testLegacyParseError( self ):
+        self.assertEqual(self.retriedTables(
+            stderr=b'iptables-restore: Error occurred at line: 5\n'),
+            ['filter', 'filter'])
+
+    def testNftNatFailed( self ):
+        self.assertEqual(self.retriedTables(
+            stderr=b'iptables-restore v1.8.4 (nf_tables): line 2: '
+                   b'RULE_APPEND failed (No such file or directory)\n'),
+            ['nat', 'filter', 'filter'])
+
+    def testNotRun( self ):
+        self.assertEqual(self.retriedTables(
+            stderr=b'Another app is currently holding the xtables lock.\n'),
+            ['nat', 'filter', 'filter'])
+        self.assertEqual(self.retriedTables(error=OSError('not found')),
+                         ['nat', 'filter', 'filter'])
+
+
 #@unittest.skip("disabled container resource limit tests for development")
 class testContainernetContainerResourceLimitAPI( simpleTestTopology ):
     """
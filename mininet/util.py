@@ -5,6 +5,7 @@
 import re
 import sys
 
+from concurrent.futures import ThreadPoolExecutor
 from fcntl import fcntl, F_GETFL, F_SETFL
 from functools import partial
 from os import O_NONBLOCK
@@ -262,24 +263,25 @@ def makeIntfPair( intf1, intf2, addr1=None, addr2=None, node1=None, node2=None,
         quietRun( 'ip link del ' + intf2, shell=True )
 
     # first: create the veth pair in default namespace
-    if addr1 is None and addr2 is None:
-        cmdOutput = quietRun( 'ip link add name %s '
-                              'type veth peer name %s ' %
-                              ( intf1, intf2 ),
-                              shell=True )
-    else:
-        cmdOutput = quietRun( 'ip link add name %s '
-                              'address %s '
-                              'type veth peer name %s '
-                              'address %s ' %
-                              (  intf1, addr1, intf2, addr2 ),
-                              shell=True )
+    # If we know both nodes, ip can place each endpoint directly into
+    # its namespace, which saves us two 'ip link set netns' calls
+    opts1 = ' address %s' % addr1 if addr1 is not None else ''
+    opts2 = ' address %s' % addr2 if addr2 is not None else ''
+    move = node1 is not None and node2 is not None
+    if move:
+        opts1 += ' netns %s' % node1.pid
+        opts2 += ' netns %s' % node2.pid
+    cmdOutput = quietRun( 'ip link add name %s%s '
+                          'type veth peer name %s%s ' %
+                          ( intf1, opts1, intf2, opts2 ),
+                          shell=True )
     if cmdOutput:
         raise Exception( "Error creating interface pair (%s,%s): %s " %
                          ( intf1, intf2, cmdOutput ) )
     # second: move both endpoints into the corresponding namespaces
-    moveIntf(intf1, node1)
-    moveIntf(intf2, node2)
+    if not move:
+        moveIntf(intf1, node1)
+        moveIntf(intf2, node2)
 
 def retry( retries, delaySecs, fn, *args, **keywords ):
     """Try something several times before giving up.
@@ -295,6 +297,19 @@ def retry( retries, delaySecs, fn, *args, **keywords ):
         error( "*** gave up after %i retries\n" % tries )
         exit( 1 )
 
+def runParallel( fn, items, maxWorkers=32 ):
+    """Call fn on each item using a pool of threads.
+       fn: function to call
+       items: items to call fn on
+       maxWorkers: maximum number of threads (32)
+       returns: list of results, in order of items"""
+    items = list( items )
+    if len( items ) < 2:
+        return [ fn( item ) for item in items ]
+    workers = min( maxWorkers, len( items ) )
+    with ThreadPoolExecutor( max_workers=workers ) as pool:
+        return list( pool.map( fn, items ) )
+
 def moveIntfNoRetry( intf, dstNode, printError=False ):
     """Move interface to node, without retrying.
        intf: string, interface
@@ -364,11 +379,9 @@ def _colonHex( val, bytecount ):
        val: input as unsigned int
        bytecount: number of bytes to convert
        returns: chStr colon-hex string"""
-    pieces = []
-    for i in range( bytecount - 1, -1, -1 ):
-        piece = ( ( 0xff << ( i * 8 ) ) & val ) >> ( i * 8 )
-        pieces.append( '%02x' % piece )
-    chStr = ':'.join( pieces )
+    val &= ( 1 << ( bytecount * 8 ) ) - 1
+    chStr = ':'.join( '%02x' % byte
+                      for byte in val.to_bytes( bytecount, 'big' ) )
     return chStr
 
 def macColonHex( mac ):
@@ -682,8 +695,11 @@ def ensureRoot():
         error( '*** Mininet must run as root.\n' )
         exit( 1 )
 
-def waitListening( client=None, server='127.0.0.1', port=80, timeout=None ):
+def waitListening( client=None, server='127.0.0.1', port=80, timeout=None,
+                   minDelay=.005, maxDelay=.5 ):
     """Wait until server is listening on port.
+       minDelay: initial delay between probes, doubled up to maxDelay
+       maxDelay: maximum delay between probes
        returns True if server is listening"""
     runCmd = ( client.cmd if client else
                partial( quietRun, shell=True ) )
@@ -693,6 +709,7 @@ def waitListening( client=None, server='127.0.0.1', port=80, timeout=None ):
     serverIP = server if isinstance( server, BaseString ) else server.IP()
     cmd = ( 'echo A | telnet -e A %s %s' % ( serverIP, port ) )
     time = 0
+    delay = minDelay
     result = runCmd( cmd )
     while 'Connected' not in result:
         if 'No route' in result:
@@ -703,8 +720,10 @@ def waitListening( client=None, server='127.0.0.1', port=80, timeout=None ):
             error( 'could not connect to %s on port %d\n' % ( server, port ) )
             return False
         debug( 'waiting for', server, 'to listen on port', port, '\n' )
-        info( '.' )
-        sleep( .5 )
-        time += .5
+        if delay >= maxDelay:
+            info( '.' )
+        sleep( delay )
+        time += delay
+        delay = min( delay * 2, maxDelay )
         result = runCmd( cmd )
     return True